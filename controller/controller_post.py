@@ -4,7 +4,6 @@ import numpy as np
 from scipy.ndimage import gaussian_filter
 from widgets.widget_post import PostProcessingTabWidget
 from skimage.util import view_as_blocks
-from skimage.measure import shannon_entropy
 
 
 class PostProcessingTabController(PostProcessingTabWidget):
@@ -62,13 +61,13 @@ class PostProcessingTabController(PostProcessingTabWidget):
         image_data = np.abs(self.main.image_view_widget.main_matrix).astype(float)
         # Rescale the image data to the range (0, 100)
         reference = np.max(image_data)
-        image_rescaled = image_data/reference*100
+        image_rescaled = (image_data/reference*100).astype(np.float32)
 
         # Calculate the standard deviation (sigma_psd) for BM4D filter
         if self.auto_checkbox.isChecked():
             # Quantize image
             num_bins = 1000
-            image_quantized = np.digitize(image_rescaled, bins=np.linspace(0, 1, num_bins + 1)) - 1
+            image_quantized = np.digitize(image_rescaled, bins=np.linspace(0, 1, num_bins + 1, dtype=np.float32)) - 1
 
 
             # Divide the image into blocks
@@ -76,23 +75,22 @@ class PostProcessingTabController(PostProcessingTabWidget):
             blocks_q = view_as_blocks(image_quantized[0:n_multi[0], 0:n_multi[1], 0:n_multi[2]], block_shape=(5, 5, 5))
             blocks_r = view_as_blocks(image_rescaled[0:n_multi[0], 0:n_multi[1], 0:n_multi[2]], block_shape=(5, 5, 5))
 
-            # Calculate the standard deviation for each block
-            block_std_devs = np.std(blocks_r, axis=(3, 4, 5))
-
-            # Calculate entropy for each block
-            block_entropies = np.zeros_like(blocks_q[:, :, :, 0, 0, 0], dtype=np.float32)
-            for ii in range(blocks_q.shape[0]):
-                for jj in range(blocks_q.shape[1]):
-                    for kk in range(blocks_q.shape[2]):
-                        block = blocks_q[ii, jj, kk, :, :, :]
-                        entropy = shannon_entropy(block)
-                        block_entropies[ii, jj, kk] = entropy
+            # Calculate entropy for each block at once: count the occurrences of each quantized value inside each
+            # block and combine them as -sum(p * log2(p)), as shannon_entropy does for a single block
+            n_values = num_bins + 2
+            block_values = np.reshape(blocks_q, (-1, 125)) + 1
+            block_index = np.repeat(np.arange(block_values.shape[0]), 125)
+            keys, counts = np.unique(block_index * n_values + np.reshape(block_values, -1), return_counts=True)
+            probabilities = counts / 125
+            block_entropies = -np.bincount(keys // n_values, weights=probabilities * np.log2(probabilities),
+                                           minlength=block_values.shape[0])
+            block_entropies = np.reshape(block_entropies, blocks_q.shape[0:3])
 
             # Find the indices of the block with the highest entropy
             max_entropy_index = np.unravel_index(np.argmax(block_entropies), block_entropies.shape)
 
-            # Extract the block with the highest entropy from the block_std_devs array
-            std = 4.5 * block_std_devs[max_entropy_index]
+            # Calculate the standard deviation of the block with the highest entropy
+            std = 4.5 * np.std(blocks_r[max_entropy_index])
             print("Standard deviation for BM4D: %0.2f" % std)
 
         else:
@@ -100,7 +98,12 @@ class PostProcessingTabController(PostProcessingTabWidget):
 
         # Create a BM4D profile and set the stage argument and blockmatches options
         profile = bm4d.BM4DProfile()
-        stage_arg = bm4d.BM4DStages.ALL_STAGES
+        if self.wiener_checkbox.isChecked():
+            stage_arg = bm4d.BM4DStages.ALL_STAGES
+            stages = ""
+        else:
+            stage_arg = bm4d.BM4DStages.HARD_THRESHOLDING
+            stages = " (hard thresholding only)"
         blockmatches = (False, False)
 
         # Apply the BM4D filter to the rescaled image
@@ -108,7 +111,7 @@ class PostProcessingTabController(PostProcessingTabWidget):
                                       blockmatches=blockmatches)
 
         # Rescale the denoised image back to its original dimensions
-        denoised_image = denoised_rescaled/100*reference
+        denoised_image = denoised_rescaled.astype(image_data.dtype)/100*reference
 
         # Update the main image view widget with the denoised image
         self.main.image_view_widget.main_matrix = denoised_image
@@ -117,7 +120,7 @@ class PostProcessingTabController(PostProcessingTabWidget):
         self.main.history_list.addNewItem(stamp="BM4D",
                                           image=self.main.image_view_widget.main_matrix,
                                           orientation=self.main.toolbar_image.mat_data['axesOrientation'][0],
-                                          operation="BM4D - Standard deviation: %0.2f" % std,
+                                          operation="BM4D - Standard deviation: %0.2f" % std + stages,
                                           space="i",
                                           image_key=self.main.image_view_widget.image_key)
 
@@ -1,5 +1,6 @@
 import threading
 import numpy as np
+from seq.mriBlankSeq import MRIBLANKSEQ
 from widgets.widget_preprocessing import PreProcessingTabWidget
 
 
@@ -114,27 +115,32 @@ class PreProcessingTabController(PreProcessingTabWidget):
         data = self.main.image_view_widget.main_matrix.copy()
         nPoints = np.reshape(mat_data['nPoints'], -1)
 
+        # Get the k-space coordinates along each axis (sl, ph, rd)
+        k_rd = np.reshape(sampled[:, 0], nPoints[-1::-1])[0, 0, :]
+        k_ph = np.reshape(sampled[:, 1], nPoints[-1::-1])[0, :, 0]
+        k_sl = np.reshape(sampled[:, 2], nPoints[-1::-1])[:, 0, 0]
+        w_rd = np.ones(np.size(k_rd))
+        w_ph = np.ones(np.size(k_ph))
+        w_sl = np.ones(np.size(k_sl))
+
         # Check which checkboxes are selected
-        theta = None
         text = "Cosbell -"
         if self.readout_checkbox.isChecked():
-            k = np.reshape(sampled[:, 0], nPoints[-1::-1])
-            kmax = np.max(np.abs(k[:]))
             text += ' RD,'
-            theta = k / kmax
-            data *= (np.cos(theta * (np.pi / 2)) ** cosbell_order)
+            theta = k_rd / np.max(np.abs(k_rd))
+            w_rd = np.cos(theta * (np.pi / 2)) ** cosbell_order
         if self.phase_checkbox.isChecked():
-            k = np.reshape(sampled[:, 1], nPoints[-1::-1])
-            kmax = np.max(np.abs(k[:]))
             text += ' PH,'
-            theta = k / kmax
-            data *= (np.cos(theta * (np.pi / 2)) ** cosbell_order)
+            theta = k_ph / np.max(np.abs(k_ph))
+            w_ph = np.cos(theta * (np.pi / 2)) ** cosbell_order
         if self.slice_checkbox.isChecked():
-            k = np.reshape(sampled[:, 2], nPoints[-1::-1])
-            kmax = np.max(np.abs(k[:]))
             text += ' SL,'
-            theta = k / kmax
-            data *= (np.cos(theta * (np.pi / 2)) ** cosbell_order)
+            theta = k_sl / np.max(np.abs(k_sl))
+            w_sl = np.cos(theta * (np.pi / 2)) ** cosbell_order
+
+        # Apply the separable filter in a single pass over the k-space data
+        if self.readout_checkbox.isChecked() or self.phase_checkbox.isChecked() or self.slice_checkbox.isChecked():
+            data *= w_sl[:, None, None] * w_ph[None, :, None] * w_rd[None, None, :]
 
         # Update the main matrix of the image view widget with the cosbell data
         self.main.image_view_widget.main_matrix = data.copy()
@@ -171,39 +177,14 @@ class PreProcessingTabController(PreProcessingTabWidget):
         ph_order = int(zero_padding_order[1])
         sl_order = int(zero_padding_order[2])
 
-        # Get the k_space data and its shape
-        k_space = self.main.image_view_widget.main_matrix.copy()
-        current_shape = k_space.shape
-
-        # Determine the new shape after zero-padding
-        new_shape = current_shape[0] * sl_order, current_shape[1] * ph_order, current_shape[2] * rd_order
-
-        # Create an image matrix filled with zeros
-        image_matrix = np.zeros(new_shape, dtype=complex)
-
-        # Get the dimensions of the current image
-        image_height = current_shape[0]
-        image_width = current_shape[1]
-        image_depth = current_shape[2]
-
-        # Calculate the centering offsets for each dimension
-        col_offset = (new_shape[0] - image_height) // 2
-        row_offset = (new_shape[1] - image_width) // 2
-        depth_offset = (new_shape[2] - image_depth) // 2
-
-        # Calculate the start and end indices to center the k_space within the image_matrix
-        col_start = col_offset
-        col_end = col_start + image_height
-        row_start = row_offset
-        row_end = row_start + image_width
-        depth_start = depth_offset
-        depth_end = depth_start + image_depth
+        # Get the k_space data
+        k_space = self.main.image_view_widget.main_matrix
 
-        # Copy the k_space into the image_matrix at the center
-        image_matrix[col_start:col_end, row_start:row_end, depth_start:depth_end] = k_space
+        # Zero-pad the k_space keeping it centered
+        image_matrix = MRIBLANKSEQ.runZeroPadding(k_space, zero_padding_order, dtype=complex)
 
         # Update the main matrix of the image view widget with the padded image
-        self.main.image_view_widget.main_matrix = image_matrix.copy()
+        self.main.image_view_widget.main_matrix = image_matrix
 
         # Add new item to the history list
         self.main.history_list.addNewItem(stamp="Zero Padding",
@@ -9,6 +9,9 @@ import os
 
 import bm4d
 import numpy as np
+import scipy.fft as sfft
+from functools import lru_cache
+from contextlib import nullcontext
 import configs.hw_config as hw
 from datetime import date, datetime
 from scipy.io import savemat, loadmat
@@ -24,6 +27,13 @@ from skimage.measure import shannon_entropy
 from manager.dicommanager import DICOMImage
 import shutil
 
+# Check if pyFFTW is available to be used as scipy.fft backend in the image reconstruction
+try:
+    import pyfftw
+    import pyfftw.interfaces.scipy_fft
+except ImportError:
+    pyfftw = None
+
 class MRIBLANKSEQ:
     """
     Class for representing MRI sequences.
@@ -1808,30 +1818,24 @@ class MRIBLANKSEQ:
         """
 
         # Get axes in strings
-        axes_dict = {'x': 0, 'y': 1, 'z': 2}
-        axes_keys = list(axes_dict.keys())
-        axes_vals = list(axes_dict.values())
-        axes_str = ['', '', '']
-        n = 0
-        for val in axes:
-            index = axes_vals.index(val)
-            axes_str[n] = axes_keys[index]
-            n += 1
+        axes_str = ['xyz'[val] for val in axes]
 
         # Create output dictionaries to plot figures
         x_label = "%s axis" % axes_str[1]
         y_label = "%s axis" % axes_str[0]
         title = "Image"
+        permutation = (0, 1, 2)
+        flip = (slice(None), slice(None), slice(None))
         if axes[2] == 2:  # Sagittal
             title = "Sagittal"
             if axes[0] == 0 and axes[1] == 1:
-                image = np.flip(image, axis=0)
+                flip = (slice(None, None, -1), slice(None), slice(None))
                 x_label = "(-Y) A | PHASE | P (+Y)"
                 y_label = "(-X) I | READOUT | S (+X)"
                 image_orientation_dicom = [0.0, 1.0, 0.0, 0.0, 0.0, -1.0]
             else:
-                image = np.transpose(image, (0, 2, 1))
-                image = np.flip(image, axis=0)
+                permutation = (0, 2, 1)
+                flip = (slice(None, None, -1), slice(None), slice(None))
                 x_label = "(-Y) A | READOUT | P (+Y)"
                 y_label = "(-X) I | PHASE | S (+X)"
                 image_orientation_dicom = [0.0, 1.0, 0.0, 0.0, 0.0, -1.0]
@@ -1842,24 +1846,27 @@ class MRIBLANKSEQ:
                 y_label = "(-X) I | READOUT | S (+X)"
                 image_orientation_dicom = [1.0, 0.0, 0.0, 0.0, 0.0, -1.0]
             else:
-                image = np.transpose(image, (0, 2, 1))
+                permutation = (0, 2, 1)
                 x_label = "(+Z) R | READOUT | L (-Z)"
                 y_label = "(-X) I | PHASE | S (+X)"
                 image_orientation_dicom = [1.0, 0.0, 0.0, 0.0, 0.0, -1.0]
         elif axes[2] == 0:  # Transversal
             title = "Transversal"
             if axes[0] == 1 and axes[1] == 2:
-                image = np.flip(image, axis=0)
+                flip = (slice(None, None, -1), slice(None), slice(None))
                 x_label = "(+Z) R | PHASE | L (-Z)"
                 y_label = "(+Y) P | READOUT | A (-Y)"
                 image_orientation_dicom = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
             else:
-                image = np.transpose(image, (0, 2, 1))
-                image = np.flip(image, axis=0)
+                permutation = (0, 2, 1)
+                flip = (slice(None, None, -1), slice(None), slice(None))
                 x_label = "(+Z) R | READOUT | L (-Z)"
                 y_label = "(+Y) P | PHASE | A (-Y)"
                 image_orientation_dicom = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
 
+        # Reorient the image with a single transpose and flip
+        image = np.ascontiguousarray(np.transpose(image, permutation)[flip])
+
         output = {
             'widget': 'image',
             'data': image,
@@ -1870,6 +1877,57 @@ class MRIBLANKSEQ:
 
         return output, image
 
+    @staticmethod
+    def fftBackend():
+        """
+        Get a context manager that selects the scipy.fft backend for the image reconstruction.
+
+        If pyFFTW is installed, the returned context uses it as scipy.fft backend with its plan cache enabled, so
+        repeated transforms of the same shape reuse the FFTW plans. Otherwise the default scipy.fft backend is kept.
+        The backend only applies inside the context, so other scipy.fft users are not affected.
+
+        Returns:
+            context manager: The context selecting the backend.
+        """
+        if pyfftw is None:
+            return nullcontext()
+        if not pyfftw.interfaces.cache.is_enabled():
+            pyfftw.interfaces.cache.enable()
+            pyfftw.interfaces.cache.set_keepalive_time(30)
+
+        return sfft.set_backend(pyfftw.interfaces.scipy_fft)
+
+    @staticmethod
+    def getShiftMasks(shape, dtype):
+        """
+        Get the checkerboard mask that replaces the fftshift/ifftshift pair around an FFT.
+
+        For even-sized axes, shifting the data by half the matrix size before and after the FFT is equivalent to
+        multiplying both by (-1)**(i+j+k), up to a global sign (-1)**(sum(n/2)). The mask is cached per shape and
+        dtype, so repeated transforms of the same volume skip the shift copies.
+
+        Args:
+            shape (tuple): The shape of the data to be transformed. All dimensions must be even.
+            dtype (np.dtype): The real dtype of the mask.
+
+        Returns:
+            tuple: The read-only mask to be applied before and after the FFT, and the global sign (1 or -1) to be
+                applied once.
+        """
+        return MRIBLANKSEQ._getShiftMasks(tuple(shape), np.dtype(dtype))
+
+    @staticmethod
+    @lru_cache(maxsize=2)
+    def _getShiftMasks(shape, dtype):
+        # Combine the alternating sign of each axis by broadcasting, without index arrays of the full volume
+        mask = np.ones((), dtype=dtype)
+        for n in shape:
+            mask = np.multiply.outer(mask, 1 - 2 * (np.arange(n) % 2)).astype(dtype, copy=False)
+        mask.flags.writeable = False
+        sign = -1 if sum(n // 2 for n in shape) % 2 else 1
+
+        return mask, sign
+
     @staticmethod
     def runIFFT(k_space):
         """
@@ -1885,7 +1943,16 @@ class MRIBLANKSEQ:
             ndarray: The reconstructed image in the spatial domain.
 
         """
-        image = np.fft.ifftshift(np.fft.ifftn(np.fft.ifftshift(k_space)))
+        if any(n % 2 for n in k_space.shape):
+            with MRIBLANKSEQ.fftBackend():
+                return sfft.ifftshift(sfft.ifftn(sfft.ifftshift(k_space), workers=-1))
+
+        mask, sign = MRIBLANKSEQ.getShiftMasks(k_space.shape, k_space.real.dtype)
+        with MRIBLANKSEQ.fftBackend():
+            image = sfft.ifftn(k_space * mask, workers=-1, overwrite_x=True)
+        image *= mask
+        if sign < 0:
+            np.negative(image, out=image)
         return image
 
     @staticmethod
@@ -1903,11 +1970,20 @@ class MRIBLANKSEQ:
             ndarray: The k-space data.
 
         """
-        k_space = np.fft.fftshift(np.fft.fftn(np.fft.fftshift(image)))
+        if any(n % 2 for n in image.shape):
+            with MRIBLANKSEQ.fftBackend():
+                return sfft.fftshift(sfft.fftn(sfft.fftshift(image), workers=-1))
+
+        mask, sign = MRIBLANKSEQ.getShiftMasks(image.shape, image.real.dtype)
+        with MRIBLANKSEQ.fftBackend():
+            k_space = sfft.fftn(image * mask, workers=-1, overwrite_x=True)
+        k_space *= mask
+        if sign < 0:
+            np.negative(k_space, out=k_space)
         return k_space
 
     @staticmethod
-    def runBm4dFilter(image_data):
+    def runBm4dFilter(image_data, two_stage=True):
         """
         Apply the BM4D filter to denoise the image.
 
@@ -1917,6 +1993,8 @@ class MRIBLANKSEQ:
 
         Args:
             image_data (ndarray): The input image data.
+            two_stage (bool): If True, run both the hard thresholding and the Wiener stages of BM4D. If False, run only
+                the hard thresholding stage, which takes roughly half the time at a small cost in SNR.
 
         Returns:
             ndarray: The denoised image.
@@ -1924,14 +2002,17 @@ class MRIBLANKSEQ:
         """
         # Rescale the image data for processing
         reference = np.max(image_data)
-        image_rescaled = image_data / reference * 100
+        image_rescaled = (image_data / reference * 100).astype(np.float32)
 
         # Calculate the standard deviation for BM4D filter
         # (Code to calculate the standard deviation is included here)
 
         # Create a BM4D profile and set options
         profile = bm4d.BM4DProfile()
-        stage_arg = bm4d.BM4DStages.ALL_STAGES
+        if two_stage:
+            stage_arg = bm4d.BM4DStages.ALL_STAGES
+        else:
+            stage_arg = bm4d.BM4DStages.HARD_THRESHOLDING
         blockmatches = (False, False)
 
         # Apply the BM4D filter to the rescaled image
@@ -1939,7 +2020,10 @@ class MRIBLANKSEQ:
                                       blockmatches=blockmatches)
 
         # Rescale the denoised image back to its original dimensions
-        denoised_image = denoised_rescaled / 100 * reference
+        if np.issubdtype(image_data.dtype, np.floating):
+            denoised_image = denoised_rescaled.astype(image_data.dtype) / 100 * reference
+        else:
+            denoised_image = denoised_rescaled.astype(np.float64) / 100 * reference
 
         return denoised_image
 
@@ -1962,41 +2046,45 @@ class MRIBLANKSEQ:
         nPoints = data.shape
 
         # Along readout
-        k = np.reshape(sampled[:, 0], nPoints)
-        kmax = np.max(np.abs(k[:]))
-        theta = k / kmax
-        data *= (np.cos(theta * (np.pi / 2)) ** cosbell_order)
+        k = np.reshape(sampled[:, 0], nPoints)[0, 0, :]
+        theta = k / np.max(np.abs(k))
+        w_rd = np.cos(theta * (np.pi / 2)) ** cosbell_order
 
         # Along phase
-        k = np.reshape(sampled[:, 1], nPoints)
-        kmax = np.max(np.abs(k[:]))
-        theta = k / kmax
-        data *= (np.cos(theta * (np.pi / 2)) ** cosbell_order)
+        k = np.reshape(sampled[:, 1], nPoints)[0, :, 0]
+        theta = k / np.max(np.abs(k))
+        w_ph = np.cos(theta * (np.pi / 2)) ** cosbell_order
 
         # Along slice
-        k = np.reshape(sampled[:, 2], nPoints)
-        kmax = np.max(np.abs(k[:]))
-        theta = k / kmax
-        data *= (np.cos(theta * (np.pi / 2)) ** cosbell_order)
+        k = np.reshape(sampled[:, 2], nPoints)[:, 0, 0]
+        theta = k / np.max(np.abs(k))
+        w_sl = np.cos(theta * (np.pi / 2)) ** cosbell_order
+
+        # Apply the three separable weights in a single pass
+        data *= w_sl[:, None, None] * w_ph[None, :, None] * w_rd[None, None, :]
 
         return data
 
     @staticmethod
-    def runZeroPadding(k_space, zero_padding_order):
+    def runZeroPadding(k_space, zero_padding_order, out=None, dtype=None):
         """
         Perform the zero-padding operation on k-space data.
 
         This method applies zero-padding to the loaded k-space data to increase its size.
         The padding order is specified for each dimension: readout (rd), phase (ph), and slice (sl).
-        The padded k-space data is returned as a new matrix.
+        The padded k-space data is returned as a new matrix, or written into `out` if given.
 
         Args:
             k_space (ndarray): The 3D matrix k-space data to be zero-padded.
             zero_padding_order (str): The zero-padding order for each dimension represented as a string.
                 The order should consist of three integers specifying the padding factor for the readout, phase, and
                 slice dimensions, respectively.
+            out (ndarray, optional): Preallocated matrix with the zero-padded shape where the result is written, so
+                repeated calls can reuse the same buffer.
+            dtype (np.dtype, optional): Data type of the new matrix when `out` is not given. Defaults to the data type
+                of `k_space`.
 
-        Returns:sa
+        Returns:
             ndarray: The 3D matrix containing the zero-padded k-space data.
         """
         # Zero-padding order for each dimension from the text field
@@ -2013,30 +2101,29 @@ class MRIBLANKSEQ:
             current_shape[1] * ph_order,
             current_shape[2] * rd_order
         )
+        if dtype is None:
+            dtype = k_space.dtype
+
+        # Get the centered region of the k-space that is kept and where it goes in the new matrix
+        crops = tuple(slice(max(0, (n0 - n1) // 2), max(0, (n0 - n1) // 2) + min(n0, n1))
+                      for n0, n1 in zip(current_shape, new_shape))
+        region = tuple(slice(max(0, (n1 - n0) // 2), max(0, (n1 - n0) // 2) + min(n0, n1))
+                       for n0, n1 in zip(current_shape, new_shape))
+
+        # Cropping only: nothing to fill with zeros
+        if all(n1 <= n0 for n0, n1 in zip(current_shape, new_shape)):
+            if out is None:
+                return np.array(k_space[crops], dtype=dtype)
+            out[...] = k_space[crops]
+            return out
 
-        # Create an image matrix filled with zeros
-        image_matrix = np.zeros(new_shape, dtype=complex)
-
-        # Get the dimensions of the current k-space data
-        image_height = current_shape[0]
-        image_width = current_shape[1]
-        image_depth = current_shape[2]
-
-        # Calculate the centering offsets for each dimension
-        col_offset = (new_shape[0] - image_height) // 2
-        row_offset = (new_shape[1] - image_width) // 2
-        depth_offset = (new_shape[2] - image_depth) // 2
-
-        # Calculate the start and end indices to center the k-space within the image_matrix
-        col_start = col_offset
-        col_end = col_start + image_height
-        row_start = row_offset
-        row_end = row_start + image_width
-        depth_start = depth_offset
-        depth_end = depth_start + image_depth
-
-        # Copy the k-space data into the image_matrix at the center
-        image_matrix[col_start:col_end, row_start:row_end, depth_start:depth_end] = k_space
+        # Create an image matrix filled with zeros and copy the k-space data at the center
+        if out is None:
+            image_matrix = np.zeros(new_shape, dtype=dtype)
+        else:
+            image_matrix = out
+            image_matrix.fill(0)
+        image_matrix[region] = k_space[crops]
 
         return image_matrix
 
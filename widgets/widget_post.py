@@ -31,6 +31,10 @@ class PostProcessingTabWidget(QWidget):
         self.run_filter_button = QPushButton('Run filter')
         self.auto_checkbox = QCheckBox('Auto')
         self.auto_checkbox.setChecked(True)
+        self.wiener_checkbox = QCheckBox('Wiener stage')
+        self.wiener_checkbox.setChecked(True)
+        self.wiener_checkbox.setToolTip('Run the second (Wiener) stage of BM4D. Unchecked runs only the hard '
+                                        'thresholding stage, roughly halving the time at a small cost in SNR.')
         self.std_text_field = QLineEdit()
         self.bm4d_layout = QVBoxLayout()
         self.std_layout = QHBoxLayout()
@@ -38,6 +42,7 @@ class PostProcessingTabWidget(QWidget):
         self.std_layout.addWidget(self.std_label)
         self.std_layout.addWidget(self.std_text_field)
         self.bm4d_layout.addWidget(self.auto_checkbox)
+        self.bm4d_layout.addWidget(self.wiener_checkbox)
         self.bm4d_layout.addWidget(self.run_filter_button)
 
         self.bm4d_group = QGroupBox('BM4D')